@@ -9,23 +9,46 @@
 
 from argparse import ArgumentParser
 from argparse import Namespace as ArgNamespace
+from concurrent.futures import ThreadPoolExecutor
 from getpass import getpass
-from json import JSONDecodeError, dump, loads
+from json import JSONDecodeError, dump, dumps, loads
 from logging import DEBUG, INFO, FileHandler, Formatter, Logger, getLogger
 from os import environ
 from pathlib import Path
 from sys import argv
 from sys import exit as sys_exit
+from time import perf_counter
 
 from colorama import Fore, Style
 from notifypy import Notify
 
 import src.auth
 import src.credentials
+import src.interfaces
+import src.metrics
+import src.netlink
+import src.scan
+import src.state
+import src.watcher
 
 # set the logger level
 LOGGER_LEVEL = INFO
 
+# total time (in milliseconds) a pre-down logout may hold up the interface teardown
+DEFAULT_PREDOWN_DEADLINE = 300
+
+# when logging in on several interfaces, report the most favourable status
+LOGIN_STATUS_PRIORITY = (
+    'login-success',
+    'session-exists',
+    'password-failure',
+    'id-failure',
+    'not-on-vit'
+)
+
+# login statuses that leave the interface with a session
+SESSION_STATUSES = ('login-success', 'session-exists')
+
 # set a scheme for the notifying the user based on custom status messages
 # in general, the user is notified only of failures or other abnormal events
 # the user is not notified if they are expected to be active on a command line
@@ -72,6 +95,14 @@ DEFAULT_USER_NOTIFICATION_SCHEME: dict[str, dict[str, str | bool]] = {
         'title': "Logged out of the Wi-Fi network",
         'error': False
     },
+    'logout-pending': {
+        'notification': False,
+        'error': False
+    },
+    'logout-unconfirmed': {
+        'notification': False,
+        'error': False
+    },
     'not-on-vit': {
         'notification': False,
         'error': False
@@ -80,6 +111,10 @@ DEFAULT_USER_NOTIFICATION_SCHEME: dict[str, dict[str, str | bool]] = {
         'notification': False,
         'error': False
     },
+    'no-address': {
+        'notification': False,
+        'error': True
+    },
     'credadd-success': {
         'notification': False,
         'error': False
@@ -95,9 +130,37 @@ DEFAULT_USER_NOTIFICATION_SCHEME: dict[str, dict[str, str | bool]] = {
     'credpurge-failure': {
         'notification': False,
         'error': True
+    },
+    'scan-success': {
+        'notification': False,
+        'error': False
+    },
+    'handoff-success': {
+        'notification': False,
+        'error': False
+    },
+    'handoff-failure': {
+        'notification': True,
+        'message': "Could not switch to a better access point",
+        'title': "Connection failed",
+        'error': True
+    },
+    'watch-stopped': {
+        'notification': False,
+        'error': False
+    },
+    'replay-success': {
+        'notification': False,
+        'error': False
     }
 }
 
+# set the path of the node_exporter textfile-collector file to export metrics
+# metrics are not exported if the path is not set
+DEFAULT_METRICS_SETTINGS: dict[str, str | None] = {
+    'textfile-path': None
+}
+
 # raise a default notification in case of a key error
 DEFAULT_NOTIFICATION: dict[str, str | bool] = {
     'notification': True,
@@ -131,7 +194,8 @@ def load_settings(settings_file_path: Path, logger: Logger) -> dict[str, dict[st
         logger.info("Creating settings file with default settings.")
 
         USER_SETTINGS = {
-            "notification-settings": DEFAULT_USER_NOTIFICATION_SCHEME
+            "notification-settings": DEFAULT_USER_NOTIFICATION_SCHEME,
+            "metrics-settings": DEFAULT_METRICS_SETTINGS
         }
 
         dump(USER_SETTINGS, settings_file, indent=4)
@@ -140,9 +204,9 @@ def load_settings(settings_file_path: Path, logger: Logger) -> dict[str, dict[st
     return USER_SETTINGS
 
 
-def init(__name__: str) -> tuple[dict[str, dict[str, dict[str, str | bool]]], Path, Logger]:
+def init(__name__: str) -> tuple[dict[str, dict[str, dict[str, str | bool]]], Path, Path, Path, Logger]:
     """initialize objects for later use
-    - set file path objects for credentials and logging
+    - set file path objects for credentials, state, metrics and logging
     - configure the loggers
     """
 
@@ -174,17 +238,37 @@ def init(__name__: str) -> tuple[dict[str, dict[str, dict[str, str | bool]]], Pa
     src.credentials.logger.addHandler(logger_file_handler)
     src.credentials.logger.setLevel(LOGGER_LEVEL)
 
+    src.interfaces.logger.addHandler(logger_file_handler)
+    src.interfaces.logger.setLevel(LOGGER_LEVEL)
+
+    src.metrics.logger.addHandler(logger_file_handler)
+    src.metrics.logger.setLevel(LOGGER_LEVEL)
+
+    src.netlink.logger.addHandler(logger_file_handler)
+    src.netlink.logger.setLevel(LOGGER_LEVEL)
+
+    src.scan.logger.addHandler(logger_file_handler)
+    src.scan.logger.setLevel(LOGGER_LEVEL)
+
+    src.state.logger.addHandler(logger_file_handler)
+    src.state.logger.setLevel(LOGGER_LEVEL)
+
+    src.watcher.logger.addHandler(logger_file_handler)
+    src.watcher.logger.setLevel(LOGGER_LEVEL)
+
     logger.addHandler(logger_file_handler)
     logger.setLevel(LOGGER_LEVEL)
 
     # set the paths for individual files
     CREDENTIALS_FILE_PATH = FOLDER_PATH / "credentials.json"
     SETTINGS_FILE_PATH = FOLDER_PATH / "wicon-settings.json"
+    STATE_FILE_PATH = FOLDER_PATH / "wicon-state.json"
+    METRICS_FILE_PATH = FOLDER_PATH / "wicon-metrics.json"
 
     # load the user settings
     USER_SETTINGS = load_settings(SETTINGS_FILE_PATH, logger)
 
-    return USER_SETTINGS, CREDENTIALS_FILE_PATH, logger
+    return USER_SETTINGS, CREDENTIALS_FILE_PATH, STATE_FILE_PATH, METRICS_FILE_PATH, logger
 
 
 def define_and_read_args(arguments: list[str]) -> ArgNamespace:
@@ -234,6 +318,23 @@ def define_and_read_args(arguments: list[str]) -> ArgNamespace:
         action='store_true',
         help="Notify the user of the status."
     )
+    disconnect_parser.add_argument(
+        '-d',
+        '--predown',
+        action='store_true',
+        help="Fire the logout using the last known SSID and return without waiting for the server."
+    )
+    disconnect_parser.add_argument(
+        '-i',
+        '--interface',
+        help="Interface going down, for --predown (default: any interface last seen on a VIT network)."
+    )
+    disconnect_parser.add_argument(
+        '--deadline',
+        type=int,
+        default=DEFAULT_PREDOWN_DEADLINE,
+        help=f"Total time in milliseconds a pre-down logout may take (default: {DEFAULT_PREDOWN_DEADLINE})."
+    )
 
     add_credentials = functions.add_parser(
         'addcreds',
@@ -247,23 +348,100 @@ def define_and_read_args(arguments: list[str]) -> ArgNamespace:
     )
     purge_credentials.set_defaults(func=purgecreds)
 
+    scan_parser = functions.add_parser(
+        'scan',
+        help="Rank the nearby VIT access points."
+    )
+    scan_parser.set_defaults(func=scan)
+    scan_parser.add_argument(
+        '-a',
+        '--all',
+        action='store_true',
+        help="Also list the access points that are not on the VIT network."
+    )
+    scan_parser.add_argument(
+        '-c',
+        '--connect',
+        action='store_true',
+        help="Connect to the best VIT access point."
+    )
+    scan_parser.add_argument(
+        '-n',
+        '--notify',
+        action='store_true',
+        help="Notify the user of the status."
+    )
+
+    watch_parser = functions.add_parser(
+        'watch',
+        help="Login/logout as soon as the Wi-Fi link changes."
+    )
+    watch_parser.set_defaults(func=watch)
+    watch_parser.add_argument(
+        '-n',
+        '--notify',
+        action='store_true',
+        help="Notify the user of the status."
+    )
+    watch_parser.add_argument(
+        '--debounce',
+        type=int,
+        default=src.watcher.DEFAULT_DEBOUNCE,
+        help=f"Time in milliseconds a link must stay up/down before acting on it (default: {src.watcher.DEFAULT_DEBOUNCE})."
+    )
+    watch_parser.add_argument(
+        '--deadline',
+        type=int,
+        default=DEFAULT_PREDOWN_DEADLINE,
+        help=f"Total time in milliseconds a logout on teardown may take (default: {DEFAULT_PREDOWN_DEADLINE})."
+    )
+    watch_parser.add_argument(
+        '--record',
+        type=Path,
+        help="Append the raw netlink events to this file."
+    )
+    watch_parser.add_argument(
+        '--replay',
+        type=Path,
+        help="Replay recorded netlink events and print the actions that would be taken, without acting on them."
+    )
+
     return main_parser.parse_args(arguments)
 
 
 def connect(parsed_arguments: ArgNamespace) -> str:
     """log in to the Wi-Fi network
-    - check if on VIT network
+    - find the wireless interfaces on a VIT network
     - get credentials and handle relevant CLI arguments
-    - send the request
+    - send the request from each interface
     - return the response/status"""
 
-    ssid = src.auth.get_ssid()
-    if ssid == 'not-connected':
+    interfaces = src.interfaces.discover_interfaces()
+    src.state.save_interfaces(STATE_FILE_PATH, interfaces)
+
+    connected_interfaces = [interface for interface in interfaces if interface['ssid'] != 'not-connected']
+    if not connected_interfaces:
+        src.metrics.record_ssid('not-connected')
         return 'not-connected'
 
-    if not src.auth.check_ssid(ssid):
+    vit_interfaces = [interface for interface in connected_interfaces if interface['vit']]
+    ssid = str((vit_interfaces or connected_interfaces)[0]['ssid'])
+
+    src.metrics.record_ssid(ssid)
+
+    if not vit_interfaces:
         return 'not-on-vit'
 
+    # an unbound login would leave through whichever interface the OS picks, so skip interfaces without an address
+    for interface in vit_interfaces:
+        if not interface['address']:
+            logger.warning(f"No address on {interface['interface']}. Skipping.")
+            print(f"{Fore.YELLOW}{Style.BRIGHT}No address on {interface['interface']} ({interface['ssid']}). Skipped.{Style.RESET_ALL}")
+
+    vit_interfaces = [interface for interface in vit_interfaces if interface['address']]
+    if not vit_interfaces:
+        return 'no-address'
+
     logger.info("Attempting to login.")
 
     try:
@@ -283,16 +461,51 @@ def connect(parsed_arguments: ArgNamespace) -> str:
     if not (('register-number' in credentials) and ('password' in credentials)):
         logger.warning("Possibly missing credentials.")
 
-    login_response_code = src.auth.login(credentials)
+    def login_interface(interface: dict[str, str | bool | None]) -> str | Exception:
+        start_time = perf_counter()
 
-    if login_response_code == 'login-success':
-        print(f"{Fore.GREEN}{Style.BRIGHT}Logged in successfully.{Style.RESET_ALL}")
-    elif login_response_code == 'session-exists':
-        print(f"{Fore.YELLOW}{Style.BRIGHT}Already logged in.{Style.RESET_ALL}")
-    else:
-        print(f"{Fore.RED}{Style.BRIGHT}Failed to login.{Style.RESET_ALL}")
+        try:
+            status = src.auth.login(credentials, interface['address'], interface['interface'])  # type: ignore
+
+        except Exception as e:
+            logger.exception(e)
+            src.metrics.record_login(perf_counter() - start_time, 'exception')
+            return e
+
+        src.metrics.record_login(perf_counter() - start_time, status)
+        return status
+
+    with ThreadPoolExecutor(max_workers=len(vit_interfaces)) as executor:
+        results = list(executor.map(login_interface, vit_interfaces))
+
+    # report the outcome for every interface in one pass
+    for interface, result in zip(vit_interfaces, results):
+        name = f"{interface['interface']} ({interface['ssid']})"
 
-    return login_response_code
+        if result == 'login-success':
+            print(f"{Fore.GREEN}{Style.BRIGHT}Logged in successfully on {name}.{Style.RESET_ALL}")
+        elif result == 'session-exists':
+            print(f"{Fore.YELLOW}{Style.BRIGHT}Already logged in on {name}.{Style.RESET_ALL}")
+        else:
+            print(f"{Fore.RED}{Style.BRIGHT}Failed to login on {name}.{Style.RESET_ALL}")
+
+    # remember which interfaces hold a session, so only those are logged out when they go down
+    src.state.save_sessions(
+        STATE_FILE_PATH,
+        {str(interface['interface']): result in SESSION_STATUSES for interface, result in zip(vit_interfaces, results)}
+    )
+
+    statuses = [result for result in results if isinstance(result, str)]
+
+    # if every interface failed, surface the error as before
+    if not statuses:
+        raise results[0]  # type: ignore
+
+    for login_response_code in LOGIN_STATUS_PRIORITY:
+        if login_response_code in statuses:
+            return login_response_code
+
+    return statuses[0]
 
 
 def disconnect(parsed_arguments: ArgNamespace) -> str:
@@ -301,8 +514,15 @@ def disconnect(parsed_arguments: ArgNamespace) -> str:
     - send the request
     - return the response/status"""
 
+    if parsed_arguments.predown:
+        return predown_disconnect(parsed_arguments.deadline / 1000, parsed_arguments.interface)
+
     ssid = src.auth.get_ssid()
+    src.metrics.record_ssid(ssid)
+
+    # nothing is associated, so no interface can still hold a session
     if ssid == 'not-connected':
+        src.state.forget_interfaces(STATE_FILE_PATH)
         return 'not-connected'
 
     if not src.auth.check_ssid(ssid):
@@ -320,6 +540,58 @@ def disconnect(parsed_arguments: ArgNamespace) -> str:
     return logout_response_code
 
 
+def predown_disconnect(deadline: float, interface: str | None = None, detach: bool = True) -> str:
+    """log out of the Wi-Fi network while the interface is going down
+    - check the interface's last known SSID instead of querying it
+    - without an interface, use any interface last seen on a VIT network
+    - fire the request and return within the deadline
+    - record the outcome in the state file once it arrives
+
+    the deadline starts when the logout is fired, so it doesn't cover starting the interpreter and importing modules"""
+
+    saved_interfaces = src.state.get_interfaces(STATE_FILE_PATH)
+    if interface is not None:
+        saved_interfaces = {interface: saved_interfaces[interface]} if interface in saved_interfaces else dict()
+
+    connected_interfaces = {name: saved_interface for name, saved_interface in saved_interfaces.items() if saved_interface['ssid'] != 'not-connected'}
+    vit_interfaces = {name: saved_interface for name, saved_interface in connected_interfaces.items() if src.auth.check_ssid(str(saved_interface['ssid']))}
+
+    if not connected_interfaces:
+        src.metrics.record_ssid('not-connected')
+        return 'not-connected'
+
+    name, saved_interface = next(iter((vit_interfaces or connected_interfaces).items()))
+    src.metrics.record_ssid(str(saved_interface['ssid']))
+
+    if not vit_interfaces:
+        return 'not-on-vit'
+
+    # the interface is going away, so it won't hold a session once the logout is fired
+    if interface is not None:
+        src.state.forget_interfaces(STATE_FILE_PATH, [interface])
+
+    logger.info("Attempting to logout before the interface goes down.")
+
+    return fire_logout(deadline, saved_interface['address'], name, detach)  # type: ignore
+
+
+def fire_logout(deadline: float, source_address: str | None, interface: str | None, detach: bool = True) -> str:
+    """fire a logout and return within the deadline
+    - send it from the address (and interface) the session was logged in from, so no other session is logged out
+    - record the outcome in the state file once it arrives"""
+
+    # overwritten by the sender once the server answers
+    src.state.record_logout(STATE_FILE_PATH, 'logout-pending')
+
+    return src.auth.logout_nowait(
+        deadline,
+        lambda status: src.state.record_logout(STATE_FILE_PATH, status),
+        detach,
+        source_address,
+        interface
+    )
+
+
 def addcreds(parsed_arguments: ArgNamespace) -> str:
     """store/edit user credentials
     - get user credentials
@@ -388,6 +660,147 @@ def purgecreds(parsed_arguments: ArgNamespace) -> str:
     return 'credpurge-failure'
 
 
+def scan(parsed_arguments: ArgNamespace) -> str:
+    """rank the nearby access points
+    - read the cached scan results of every wireless interface
+    - rank the VIT access points and print them as JSON
+    - optionally connect to the best one"""
+
+    interfaces = src.interfaces.get_wireless_interfaces()
+    if not interfaces:
+        return 'not-connected'
+
+    logger.info("Reading scan results.")
+
+    results = []
+    errors: list[OSError] = []
+    for interface in interfaces:
+        # an interface without nl80211 support shouldn't stop the others being scanned
+        try:
+            results.extend(src.scan.get_scan_results(interface))
+
+        except OSError as e:
+            logger.warning(f"Could not read scan results for {interface}: {e!r}")
+            errors.append(e)
+
+    # if no interface could be read, there's nothing to rank, so surface the error
+    if len(errors) == len(interfaces):
+        raise errors[0]
+
+    access_points = src.scan.rank_access_points(results)
+    vit_access_points = [access_point for access_point in access_points if access_point['vit']]
+
+    print(dumps(access_points if parsed_arguments.all else vit_access_points, indent=4))
+
+    if not vit_access_points:
+        return 'not-on-vit'
+
+    if not parsed_arguments.connect:
+        return 'scan-success'
+
+    best_access_point = vit_access_points[0]
+    if best_access_point['associated']:
+        logger.info("Already connected to the best access point.")
+        return 'scan-success'
+
+    logger.info(f"Connecting to {best_access_point['bssid']} on {best_access_point['interface']}.")
+
+    if src.scan.connect_access_point(best_access_point):
+        return 'handoff-success'
+
+    return 'handoff-failure'
+
+
+def watch(parsed_arguments: ArgNamespace) -> str:
+    """login/logout as the Wi-Fi link changes
+    - replay a recording, if given, and print the actions
+    - otherwise watch the links until interrupted
+    - on an address on a wireless link, run the login flow
+    - on teardown of an interface that logged in, fire a logout like the pre-down hook"""
+
+    if parsed_arguments.replay:
+        actions = src.watcher.replay(parsed_arguments.replay, parsed_arguments.debounce / 1000)
+        print(dumps(actions, indent=4))
+        return 'replay-success'
+
+    def on_action(action: str, interface: str, address: str) -> bool:
+        has_session = False
+
+        try:
+            if action == 'login':
+                status_message = connect(ArgNamespace(registernumber=None, password=None))
+
+                saved_interface = src.state.get_interfaces(STATE_FILE_PATH).get(interface, dict())
+                has_session = bool(saved_interface.get('session')) and saved_interface.get('address') == address
+
+            else:
+                # the watcher only logs out interfaces it saw log in, from the address they logged in from
+                # the watcher keeps running, so the logout can finish on a thread instead of a detached process
+                status_message = fire_logout(parsed_arguments.deadline / 1000, address, interface, detach=False)
+                src.state.forget_interfaces(STATE_FILE_PATH, [interface])
+
+        except Exception as e:
+            logger.exception(e)
+            status_message = 'exception'
+
+        report_status(status_message, parsed_arguments.notify)
+        export_metrics(status_message)
+
+        return has_session
+
+    logger.info("Attempting to watch the Wi-Fi links.")
+
+    try:
+        src.watcher.watch(on_action, parsed_arguments.debounce / 1000, parsed_arguments.record)
+
+    except KeyboardInterrupt:
+        pass
+
+    return 'watch-stopped'
+
+
+def report_status(status_message: str, notify: bool) -> int:
+    """report a status to the user
+    - notify the user if the status calls for it
+    - return the exit code for the status"""
+
+    # check whether the status message should trigger a notification
+    # fall back to the default scheme for statuses added after the settings file was created
+    current_status: dict[str, dict[str, str | bool]] = USER_SETTINGS.get('notification-settings', dict()).get(status_message, DEFAULT_USER_NOTIFICATION_SCHEME.get(status_message, DEFAULT_NOTIFICATION))  # type: ignore
+
+    # if the status is an abnormal behaviour or failure, notify the user
+    if current_status.get('notification', True):
+        notification = Notify(
+            default_notification_title=current_status.get('title', DEFAULT_NOTIFICATION['title']),  # type: ignore
+            default_notification_message=current_status.get('message', DEFAULT_NOTIFICATION['message']),  # type: ignore
+            default_notification_application_name="Wi-Con"
+        )
+
+        if notify:
+            notification.send(block=False)
+
+    logger.info(status_message)
+
+    # if the status is an error, exit with a non-zero exit code
+    return int(current_status.get('error', True))
+
+
+def export_metrics(status_message: str) -> None:
+    """export this run's metrics, if enabled in the settings
+    - never let a metrics failure change the outcome of the run"""
+
+    textfile_path = USER_SETTINGS.get('metrics-settings', dict()).get('textfile-path')
+    if not textfile_path:
+        return
+
+    try:
+        src.metrics.flush(METRICS_FILE_PATH, Path(textfile_path), status_message)  # type: ignore
+
+    # this runs while exiting, so no failure may escape
+    except Exception as e:
+        logger.warning(f"Could not export metrics: {e!r}")
+
+
 def main(arguments: list[str]) -> int:
     """main function
     - parses the command line arguments
@@ -402,6 +815,7 @@ def main(arguments: list[str]) -> int:
     # notify the user if an error occurs
     except Exception as e:
         logger.exception(e)
+        status_message = 'exception'
         notification = Notify(
             default_notification_title="Error",
             default_notification_message=e.args[0],
@@ -412,30 +826,14 @@ def main(arguments: list[str]) -> int:
         exit_code = 1
 
     else:
-        # check whether the status message should trigger a notification
-        current_status: dict[str, dict[str, str | bool]] = USER_SETTINGS.get('notification-settings', dict()).get(status_message, DEFAULT_NOTIFICATION)  # type: ignore
-        
-        # if the status is an abnormal behaviour or failure, notify the user
-        if current_status.get('notification', True):
-            notification = Notify(
-                default_notification_title=current_status.get('title', DEFAULT_NOTIFICATION['title']),  # type: ignore
-                default_notification_message=current_status.get('message', DEFAULT_NOTIFICATION['message']),  # type: ignore
-                default_notification_application_name="Wi-Con"
-            )
-
-            if parsed_namespace.notify:
-                notification.send(block=False)
-
-        logger.info(status_message)
-
-        # if the status is an error, exit with a non-zero exit code
-        exit_code = int(current_status.get('error', True))
+        exit_code = report_status(status_message, getattr(parsed_namespace, 'notify', False))
 
     finally:
+        export_metrics(status_message)
         logger.info(f"Exited with exit code {exit_code}.")
         return exit_code
 
 
 if __name__ == "__main__":
-    USER_SETTINGS, CREDENTIALS_FILE_PATH, logger = init(__name__)
+    USER_SETTINGS, CREDENTIALS_FILE_PATH, STATE_FILE_PATH, METRICS_FILE_PATH, logger = init(__name__)
     sys_exit(main(argv[1:]))
@@ -86,7 +86,7 @@ echo "fi" >> /tmp/wicon-py-login
 # Create logout binary
 touch /tmp/wicon-py-logout
 echo "#!/bin/sh" >> /tmp/wicon-py-logout
-echo "su $USER -c \"`pwd`/wicon-py/.venv/bin/python `pwd`/wicon-py/login_cli.py logout -n\"" >> /tmp/wicon-py-logout
+echo "su $USER -c \"`pwd`/wicon-py/.venv/bin/python `pwd`/wicon-py/login_cli.py logout -n --predown --interface \$1\"" >> /tmp/wicon-py-logout
 
 echo ""
 echo "Setting up login and logout scripts to run on network change..."
@@ -5,19 +5,37 @@ communicate with the server
 - parses the server responses
 """
 
+import os
 from http.client import OK
 from logging import getLogger
 from os import popen
 from platform import system as get_os_name
+from re import compile
 from re import match as re_match
+from select import select
+from socket import AF_INET, SOCK_DGRAM, SOCK_STREAM, SOL_SOCKET, socket
+from threading import Thread
+from typing import Callable
+from urllib.parse import urlsplit
 
 from bs4 import BeautifulSoup
-from requests import ConnectionError, get, post
+from requests import ConnectionError, Session, get, post
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
 
 # URLs for the service
 LOGIN_URL = "http://phc.prontonetworks.com/cgi-bin/authlogin"
 LOGOUT_URL = "http://phc.prontonetworks.com/cgi-bin/authlogout"
 
+# time (in seconds) a login may wait on each network operation
+LOGIN_TIMEOUT = 10
+
+# time (in seconds) a logout left running in the background may wait on each network operation
+BACKGROUND_LOGOUT_TIMEOUT = 10
+
+# socket option that binds a socket to an interface (Linux only, not exposed by `socket` on every version)
+SO_BINDTODEVICE = 25
+
 # HTML parser to understand server response
 HTML_PARSER = 'html.parser'
 
@@ -30,9 +48,82 @@ SSID_REGEX = (
     r"[a-zA-Z](-ANX)?-VIT*"
 )
 
+# all the SSID regexes as one pattern, so an SSID is checked in a single pass
+SSID_PATTERN = compile("|".join(f"(?:{regex})" for regex in SSID_REGEX))
+
 # create a logger for this module
 logger = getLogger(__name__)
 
+
+class SourceAddressAdapter(HTTPAdapter):
+    """transport adapter that binds outgoing connections to a source address
+    - also binds them to an interface, if given, since Linux picks the outgoing interface by destination alone"""
+
+    def __init__(self, source_address: str, interface: str | None = None, **kwargs) -> None:
+        self.source_address = source_address
+        self.interface = interface
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs) -> None:
+        pool_kwargs['source_address'] = (self.source_address, 0)
+
+        if self.interface:
+            pool_kwargs['socket_options'] = HTTPConnection.default_socket_options + [
+                (SOL_SOCKET, SO_BINDTODEVICE, self.interface.encode())
+            ]
+
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+
+
+def can_bind_to_device(interface: str) -> bool:
+    """check whether sockets may be bound to an interface
+    - only Linux supports it, and before Linux 5.7 it needs CAP_NET_RAW"""
+
+    if get_os_name() != 'Linux':
+        return False
+
+    try:
+        with socket(AF_INET, SOCK_STREAM) as probe_socket:
+            probe_socket.setsockopt(SOL_SOCKET, SO_BINDTODEVICE, interface.encode())
+
+    except OSError as e:
+        logger.debug(f"Can't bind to {interface}: {e!r}")
+        return False
+
+    return True
+
+
+def get_route_source(url: str) -> str | None:
+    """get the source address the OS picks to reach the host of a URL
+    - connecting a UDP socket only looks up the route, nothing is sent
+    - return None if there's no route"""
+
+    try:
+        with socket(AF_INET, SOCK_DGRAM) as route_socket:
+            route_socket.connect((urlsplit(url).hostname, 80))
+            return route_socket.getsockname()[0]
+
+    except OSError:
+        return None
+
+
+def create_bound_session(source_address: str, interface: str | None = None) -> Session:
+    """create a session whose requests leave from a source address
+    - bind to the interface too, where allowed
+    - otherwise warn if the OS routes the server through another address,
+      since binding the source address alone doesn't pick the outgoing interface"""
+
+    if interface and not can_bind_to_device(interface):
+        interface = None
+
+    if not interface and get_route_source(LOGIN_URL) != source_address:
+        logger.warning(f"The OS doesn't route the server through {source_address}. The request may leave through another interface.")
+
+    session = Session()
+    session.mount('http://', SourceAddressAdapter(source_address, interface))
+    return session
+
+
 def get_ssid() -> str:
     """get the SSID of the network the user is connected to
     - detect the operating system
@@ -79,10 +170,15 @@ def check_ssid(ssid: str) -> bool:
     - check if the SSID matches the regex for VIT networks
     - return True if connected to a VIT network, False otherwise"""
 
-    return any(map(
-        lambda regex: re_match(regex, ssid),
-        SSID_REGEX
-    ))
+    return SSID_PATTERN.match(ssid) is not None
+
+
+def classify_ssids(ssids: list[str]) -> dict[str, bool]:
+    """check a batch of SSIDs against the VIT networks
+    - check each distinct SSID only once
+    - return a mapping of SSID to whether it is a VIT network"""
+
+    return {ssid: check_ssid(ssid) for ssid in set(ssids)}
 
 
 def parse_login_response(html: bytes) -> str:
@@ -175,10 +271,10 @@ def parse_logout_response(html: bytes) -> str:
         raise ValueError("Invalid page.")
 
 
-def login(credentials: dict[str, str]) -> str:
+def login(credentials: dict[str, str], source_address: str | None = None, interface: str | None = None) -> str:
     """main login HTTP request
     - create the request
-    - send the request
+    - send the request (from `source_address` on `interface`, if given, else through the OS's default route)
     - return the response"""
 
     login_payload = {
@@ -189,10 +285,20 @@ def login(credentials: dict[str, str]) -> str:
     }
 
     try:
-        login_request = post(
-            LOGIN_URL,
-            data=login_payload
-        )
+        if source_address:
+            with create_bound_session(source_address, interface) as session:
+                login_request = session.post(
+                    LOGIN_URL,
+                    data=login_payload,
+                    timeout=LOGIN_TIMEOUT
+                )
+
+        else:
+            login_request = post(
+                LOGIN_URL,
+                data=login_payload,
+                timeout=LOGIN_TIMEOUT
+            )
 
     except ConnectionError as e:
         raise ConnectionError(f"Server-side error. Contact CTS or wait until morning.") from e
@@ -212,16 +318,25 @@ def login(credentials: dict[str, str]) -> str:
         raise ConnectionError(f"The server returned status code {login_request.status_code}.")
 
 
-def logout() -> str:
-    """main login HTTP request
+def logout(timeout: float | None = None, source_address: str | None = None, interface: str | None = None) -> str:
+    """main logout HTTP request
     - create the request
-    - send the request
+    - send the request (from `source_address` on `interface`, if given, else through the OS's default route)
     - return the response"""
 
     try:
-        logout_request = get(
-        url=LOGOUT_URL
-    )
+        if source_address:
+            with create_bound_session(source_address, interface) as session:
+                logout_request = session.get(
+                    url=LOGOUT_URL,
+                    timeout=timeout
+                )
+
+        else:
+            logout_request = get(
+                url=LOGOUT_URL,
+                timeout=timeout
+            )
 
     except ConnectionError as e:
         raise ConnectionError(f"Server-side error. Contact CTS or wait until morning.") from e
@@ -239,3 +354,84 @@ def logout() -> str:
     else:
         logger.warning(logout_request.content)
         raise ConnectionError(f"The server returned status code {logout_request.status_code}.")
+
+
+def logout_nowait(deadline: float, on_result: Callable[[str], None], detach: bool = True, source_address: str | None = None, interface: str | None = None) -> str:
+    """fire the logout HTTP request without waiting on the server
+    - send the request from a detached child process (or a background thread)
+    - send it from `source_address` on `interface`, if given, like `logout`
+    - wait for at most `deadline` seconds in total
+    - hand the outcome to `on_result` from the child/thread once it arrives
+    - return the outcome if it arrived in time, else a pending status
+
+    the child process outlives the caller, so the outcome is recorded even if the server answers after the deadline
+    without `fork` (or with `detach` off, for long-running callers) a daemon thread is used instead,
+    which only records the outcome if the caller's process is still running when it arrives"""
+
+    def send() -> str:
+        try:
+            return logout(BACKGROUND_LOGOUT_TIMEOUT, source_address, interface)
+
+        except Exception as e:
+            logger.warning(f"Logout not confirmed: {e!r}")
+            return 'logout-unconfirmed'
+
+    def report(status: str) -> None:
+        try:
+            on_result(status)
+
+        except Exception as e:
+            logger.warning(f"Couldn't record the logout status: {e!r}")
+
+    if detach and hasattr(os, 'fork'):
+        read_end, write_end = os.pipe()
+
+        if os.fork() == 0:
+            # the child must never return into the caller's code, whatever happens
+            try:
+                # leave the caller's session and stdio, so nothing waits on this process
+                os.close(read_end)
+                os.setsid()
+                null_file = os.open(os.devnull, os.O_RDWR)
+                for standard_file in (0, 1, 2):
+                    os.dup2(null_file, standard_file)
+
+                status = send()
+
+                # answer the caller first, so recording the outcome can't hold it up
+                try:
+                    os.write(write_end, status.encode())
+
+                # the caller stopped waiting after the deadline
+                except OSError:
+                    pass
+
+                os.close(write_end)
+                report(status)
+
+            finally:
+                os._exit(0)
+
+        os.close(write_end)
+        ready, _, _ = select([read_end], [], [], deadline)
+        outcome = os.read(read_end, 64).decode() if ready else ''
+        os.close(read_end)
+
+    else:
+        outcomes: list[str] = []
+
+        # a daemon thread doesn't keep the interpreter alive past the deadline
+        def send_and_report() -> None:
+            outcomes.append(send())
+            report(outcomes[0])
+
+        sender = Thread(target=send_and_report, name="wicon-logout", daemon=True)
+        sender.start()
+        sender.join(deadline)
+        outcome = outcomes[0] if outcomes else ''
+
+    if outcome:
+        return outcome
+
+    logger.info("Logout fired. Not waiting for confirmation.")
+    return 'logout-pending'
@@ -0,0 +1,168 @@
+"""
+discover wireless network interfaces
+- lists the wireless interfaces on the machine
+- gets the SSID and IPv4 address of each interface
+- classifies each interface as on/off the VIT network
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from os import popen
+from pathlib import Path
+from platform import system as get_os_name
+from shlex import quote
+from socket import AF_INET, SOCK_DGRAM, inet_ntoa, socket
+from struct import pack
+
+from src.auth import check_ssid
+
+# sysfs directory listing the network interfaces on Linux
+SYSFS_NET_PATH = Path("/sys/class/net")
+
+# ioctl request number to get the IPv4 address of an interface on Linux
+SIOCGIFADDR = 0x8915
+
+# create a logger for this module
+logger = getLogger(__name__)
+
+
+def get_wireless_interfaces() -> list[str]:
+    """list the names of the wireless interfaces
+    - detect the operating system
+    - use the appropriate source to list the interfaces"""
+
+    os_name = get_os_name()
+
+    if os_name == 'Windows':
+        output = popen("netsh wlan show interfaces").read()
+        interfaces = [
+            line.split(":", 1)[1].strip()
+            for line in output.splitlines()
+            if line.strip().startswith("Name") and ":" in line
+        ]
+
+    elif os_name == 'Linux':
+        # only wireless interfaces have a `wireless` or `phy80211` entry
+        interfaces = sorted(
+            path.name for path in SYSFS_NET_PATH.iterdir()
+            if (path / 'wireless').exists() or (path / 'phy80211').exists()
+        )
+
+    elif os_name == 'Darwin':
+        output = popen("networksetup -listallhardwareports").read()
+        interfaces = [
+            block.split("Device:")[1].split('\n')[0].strip()
+            for block in output.split("Hardware Port:")
+            if ("Wi-Fi" in block or "AirPort" in block) and "Device:" in block
+        ]
+
+    else:
+        raise NotImplementedError(f"Unsupported OS: {os_name}")
+
+    logger.debug(f"Detected wireless interfaces: {interfaces}")
+    return interfaces
+
+
+def get_interface_ssid(interface: str) -> str:
+    """get the SSID of the network an interface is connected to
+    - return the SSID or a status message if not connected"""
+
+    os_name = get_os_name()
+
+    if os_name == 'Windows':
+        output = popen("netsh wlan show interfaces").read()
+
+        # the output has one block per interface, each starting with its name
+        for block in output.split("Name")[1:]:
+            if block.split(":", 1)[1].split('\n')[0].strip() != interface:
+                continue
+
+            if "SSID" not in block or "State" not in block:
+                return 'not-connected'
+
+            status = block.split("State")[1].split(":")[1].split('\n')[0].strip()
+            if status != "connected":
+                return 'not-connected'
+
+            return block.split("SSID")[1].split(":", 1)[1].split('\n')[0].strip()
+
+        return 'not-connected'
+
+    elif os_name == 'Linux':
+        ssid = popen(f"iwgetid {quote(interface)} --raw").read().strip()
+
+    elif os_name == 'Darwin':
+        output = popen(f"ipconfig getsummary {quote(interface)} | grep -e \" *SSID\"").read()
+        if "SSID" not in output:
+            return 'not-connected'
+
+        ssid = output.split("SSID :")[1].strip()
+
+    else:
+        raise NotImplementedError(f"Unsupported OS: {os_name}")
+
+    return ssid or 'not-connected'
+
+
+def get_interface_address(interface: str) -> str | None:
+    """get the IPv4 address of an interface
+    - return None if the interface has no address"""
+
+    os_name = get_os_name()
+
+    if os_name == 'Windows':
+        output = popen(f"netsh interface ipv4 show addresses name=\"{interface}\"").read()
+        if "IP Address" not in output:
+            return None
+
+        return output.split("IP Address")[1].split(":")[1].split('\n')[0].strip()
+
+    elif os_name == 'Linux':
+        # only available on Unix, so imported here
+        from fcntl import ioctl
+
+        with socket(AF_INET, SOCK_DGRAM) as probe:
+            try:
+                request = ioctl(probe.fileno(), SIOCGIFADDR, pack('256s', interface.encode()[:15]))
+
+            except OSError:
+                return None
+
+        # the address is at offset 20 of the returned `struct ifreq`
+        return inet_ntoa(request[20:24])
+
+    elif os_name == 'Darwin':
+        return popen(f"ipconfig getifaddr {quote(interface)}").read().strip() or None
+
+    else:
+        raise NotImplementedError(f"Unsupported OS: {os_name}")
+
+
+def describe_interface(interface: str) -> dict[str, str | bool | None]:
+    """collect the SSID, address and classification of an interface"""
+
+    ssid = get_interface_ssid(interface)
+    connected = ssid != 'not-connected'
+
+    description: dict[str, str | bool | None] = {
+        'interface': interface,
+        'ssid': ssid,
+        'address': get_interface_address(interface) if connected else None,
+        'vit': connected and check_ssid(ssid)
+    }
+
+    logger.info(f"Detected interface: {description}")
+    return description
+
+
+def discover_interfaces() -> list[dict[str, str | bool | None]]:
+    """describe every wireless interface
+    - query the interfaces in parallel
+    - return the descriptions in interface order"""
+
+    interfaces = get_wireless_interfaces()
+    if not interfaces:
+        return []
+
+    with ThreadPoolExecutor(max_workers=len(interfaces)) as executor:
+        return list(executor.map(describe_interface, interfaces))
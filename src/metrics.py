@@ -0,0 +1,190 @@
+"""
+export health metrics for Prometheus
+- collects observations during a run
+- keeps running totals in a metrics state file
+- rewrites a node_exporter textfile-collector file atomically
+"""
+
+from bisect import bisect_left
+from json import JSONDecodeError, dumps, loads
+from logging import getLogger
+from pathlib import Path
+from threading import Lock
+from time import time
+
+from src.auth import check_ssid
+from src.state import locked, write_atomically
+
+# upper bounds (in seconds) of the login latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# login statuses that make a run successful
+LOGIN_SUCCESS_STATUSES = ('login-success', 'session-exists')
+
+# create a logger for this module
+logger = getLogger(__name__)
+
+# observations made during this run, written out by `flush`
+# the watcher records and flushes from several threads, so they're only touched while holding the lock
+observations_lock = Lock()
+pending_logins: list[tuple[float, str, float]] = []
+current_ssid: str | None = None
+
+
+def record_login(latency: float, status: str) -> None:
+    """record a login attempt, how long it took (in seconds) and when it finished"""
+
+    with observations_lock:
+        pending_logins.append((latency, status, time()))
+
+
+def record_ssid(ssid: str) -> None:
+    """record the SSID the user is currently connected to"""
+
+    global current_ssid
+
+    with observations_lock:
+        current_ssid = ssid
+
+
+def take_observations() -> tuple[list[tuple[float, str, float]], str | None]:
+    """take the logins recorded since the last flush, and the current SSID
+    - each login is handed out once, so concurrent flushes don't count it twice"""
+
+    with observations_lock:
+        logins = pending_logins.copy()
+        pending_logins.clear()
+
+        return logins, current_ssid
+
+
+def classify(ssid: str) -> str:
+    """classify an SSID for reporting"""
+
+    if ssid == 'not-connected':
+        return 'not-connected'
+
+    return 'vit' if check_ssid(ssid) else 'not-vit'
+
+
+def load_metrics(metrics_file_path: Path) -> dict:
+    """load the running totals
+    - return empty totals if the file doesn't exist or is unreadable"""
+
+    metrics = {
+        'status': dict(),
+        'latency-buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+        'latency-sum': 0.0,
+        'latency-count': 0,
+        'retries': 0,
+        'failing': False,
+        'last-success': None,
+        'ssid': None
+    }
+
+    if metrics_file_path.exists():
+        try:
+            metrics.update(loads(metrics_file_path.read_text()))
+
+        except JSONDecodeError:
+            logger.warning("Metrics file is corrupt. Starting over.")
+
+    # totals written with different histogram buckets can't be carried over
+    if len(metrics['latency-buckets']) != len(LATENCY_BUCKETS) + 1:
+        logger.warning("Metrics file has different latency buckets. Resetting the histogram.")
+        metrics['latency-buckets'] = [0] * (len(LATENCY_BUCKETS) + 1)
+        metrics['latency-sum'] = 0.0
+        metrics['latency-count'] = 0
+
+    return metrics
+
+
+def update_metrics(metrics: dict, status: str, logins: list[tuple[float, str, float]], ssid: str | None) -> None:
+    """fold this run's status and observations into the running totals"""
+
+    metrics['status'][status] = metrics['status'].get(status, 0) + 1
+
+    for latency, login_status, timestamp in logins:
+        metrics['latency-buckets'][bisect_left(LATENCY_BUCKETS, latency)] += 1
+        metrics['latency-sum'] += latency
+        metrics['latency-count'] += 1
+
+        if login_status == 'login-success':
+            metrics['last-success'] = max(timestamp, metrics['last-success'] or 0)
+
+    # logins on several interfaces run in parallel, so retries are counted per run, not per attempt
+    # a run that logs in after a run where every login failed is a retry
+    if logins:
+        if metrics['failing']:
+            metrics['retries'] += 1
+
+        metrics['failing'] = not any(login_status in LOGIN_SUCCESS_STATUSES for _, login_status, _ in logins)
+
+    if ssid is not None:
+        metrics['ssid'] = ssid
+
+
+def escape_label(value: str) -> str:
+    """escape a label value for the text exposition format"""
+
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def render_metrics(metrics: dict) -> str:
+    """render the running totals in the text exposition format"""
+
+    lines = [
+        "# HELP wicon_status_total Number of wicon runs ending in each status.",
+        "# TYPE wicon_status_total counter"
+    ]
+    for status, count in sorted(metrics['status'].items()):
+        lines.append(f'wicon_status_total{{status="{escape_label(status)}"}} {count}')
+
+    lines += [
+        "# HELP wicon_login_duration_seconds Time taken by login requests.",
+        "# TYPE wicon_login_duration_seconds histogram"
+    ]
+    cumulative_count = 0
+    for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), metrics['latency-buckets']):
+        cumulative_count += count
+        lines.append(f'wicon_login_duration_seconds_bucket{{le="{bound}"}} {cumulative_count}')
+    lines.append(f"wicon_login_duration_seconds_sum {metrics['latency-sum']}")
+    lines.append(f"wicon_login_duration_seconds_count {metrics['latency-count']}")
+
+    lines += [
+        "# HELP wicon_login_retries_total Login runs made after a run where every login failed.",
+        "# TYPE wicon_login_retries_total counter",
+        f"wicon_login_retries_total {metrics['retries']}"
+    ]
+
+    if metrics['last-success'] is not None:
+        lines += [
+            "# HELP wicon_last_login_success_timestamp_seconds Time of the last successful login.",
+            "# TYPE wicon_last_login_success_timestamp_seconds gauge",
+            f"wicon_last_login_success_timestamp_seconds {metrics['last-success']}"
+        ]
+
+    if metrics['ssid'] is not None:
+        ssid = '' if metrics['ssid'] == 'not-connected' else metrics['ssid']
+        lines += [
+            "# HELP wicon_ssid_info Classification of the current SSID.",
+            "# TYPE wicon_ssid_info gauge",
+            f'wicon_ssid_info{{ssid="{escape_label(ssid)}",classification="{classify(metrics["ssid"])}"}} 1'
+        ]
+
+    return "\n".join(lines) + "\n"
+
+
+def flush(metrics_file_path: Path, textfile_path: Path, status: str) -> None:
+    """write this run's metrics
+    - update the running totals while holding the lock, so overlapping runs don't lose updates
+    - rewrite the metrics state file and the textfile-collector file"""
+
+    with locked(metrics_file_path):
+        metrics = load_metrics(metrics_file_path)
+        update_metrics(metrics, status, *take_observations())
+
+        write_atomically(metrics_file_path, dumps(metrics))
+        write_atomically(textfile_path, render_metrics(metrics))
+
+    logger.debug("Metrics written.")
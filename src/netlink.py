@@ -0,0 +1,177 @@
+"""
+talk to the Linux kernel over netlink
+- opens and binds netlink sockets
+- packs and parses netlink messages and attributes
+- resolves generic netlink families and multicast groups
+"""
+
+from logging import getLogger
+from socket import SOCK_RAW, socket
+from struct import calcsize, pack, unpack_from
+
+# netlink socket constants (not exposed by `socket` on every platform)
+AF_NETLINK = 16
+NETLINK_ROUTE = 0
+NETLINK_GENERIC = 16
+SOL_NETLINK = 270
+NETLINK_ADD_MEMBERSHIP = 1
+
+# netlink message types and flags
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+
+# attribute flags, masked off to get the attribute type
+NLA_F_NESTED = 0x8000
+NLA_F_NET_BYTEORDER = 0x4000
+NLA_TYPE_MASK = ~(NLA_F_NESTED | NLA_F_NET_BYTEORDER)
+
+# generic netlink controller
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+CTRL_ATTR_MCAST_GROUPS = 7
+CTRL_ATTR_MCAST_GRP_NAME = 1
+CTRL_ATTR_MCAST_GRP_ID = 2
+
+# struct layouts (native byte order, as used by the kernel)
+NLMSGHDR_FORMAT = "=IHHII"
+NLATTR_FORMAT = "=HH"
+GENLMSGHDR_FORMAT = "=BBH"
+NLMSGHDR_LENGTH = calcsize(NLMSGHDR_FORMAT)
+NLATTR_LENGTH = calcsize(NLATTR_FORMAT)
+GENLMSGHDR_LENGTH = calcsize(GENLMSGHDR_FORMAT)
+
+# large enough for a single multi-part dump message
+RECEIVE_BUFFER_SIZE = 1 << 17
+
+# create a logger for this module
+logger = getLogger(__name__)
+
+
+def align(length: int) -> int:
+    """round a length up to the 4-byte netlink alignment"""
+
+    return (length + 3) & ~3
+
+
+def pack_attribute(attribute_type: int, payload: bytes) -> bytes:
+    """pack a netlink attribute, padded to alignment"""
+
+    length = NLATTR_LENGTH + len(payload)
+    return pack(NLATTR_FORMAT, length, attribute_type) + payload + b'\0' * (align(length) - length)
+
+
+def parse_attributes(data: bytes, offset: int = 0) -> dict[int, bytes]:
+    """parse a run of netlink attributes
+    - return a mapping of attribute type to payload
+    - if a type repeats, the last payload wins"""
+
+    attributes: dict[int, bytes] = dict()
+
+    while offset + NLATTR_LENGTH <= len(data):
+        length, attribute_type = unpack_from(NLATTR_FORMAT, data, offset)
+        if length < NLATTR_LENGTH:
+            break
+
+        attributes[attribute_type & NLA_TYPE_MASK] = data[offset + NLATTR_LENGTH:offset + length]
+        offset += align(length)
+
+    return attributes
+
+
+def pack_message(message_type: int, flags: int, payload: bytes, sequence: int = 0) -> bytes:
+    """pack a netlink message with its header"""
+
+    return pack(NLMSGHDR_FORMAT, NLMSGHDR_LENGTH + len(payload), message_type, flags, sequence, 0) + payload
+
+
+def parse_messages(data: bytes) -> list[tuple[int, int, bytes]]:
+    """split a netlink datagram into messages
+    - return (type, flags, payload) for each message"""
+
+    messages: list[tuple[int, int, bytes]] = []
+    offset = 0
+
+    while offset + NLMSGHDR_LENGTH <= len(data):
+        length, message_type, flags, _, _ = unpack_from(NLMSGHDR_FORMAT, data, offset)
+        if length < NLMSGHDR_LENGTH:
+            break
+
+        messages.append((message_type, flags, data[offset + NLMSGHDR_LENGTH:offset + length]))
+        offset += align(length)
+
+    return messages
+
+
+def open_socket(protocol: int, groups: tuple[int, ...] = ()) -> socket:
+    """open and bind a netlink socket
+    - join the given multicast groups"""
+
+    netlink_socket = socket(AF_NETLINK, SOCK_RAW, protocol)
+    netlink_socket.bind((0, 0))
+
+    for group in groups:
+        netlink_socket.setsockopt(SOL_NETLINK, NETLINK_ADD_MEMBERSHIP, group)
+
+    return netlink_socket
+
+
+def request(netlink_socket: socket, message_type: int, flags: int, payload: bytes) -> list[bytes]:
+    """send a netlink request and collect the replies
+    - read until the dump is done (or the single reply arrives)
+    - raise an exception if the kernel reports an error"""
+
+    netlink_socket.send(pack_message(message_type, NLM_F_REQUEST | flags, payload))
+
+    replies: list[bytes] = []
+    while True:
+        for reply_type, reply_flags, reply_payload in parse_messages(netlink_socket.recv(RECEIVE_BUFFER_SIZE)):
+            if reply_type == NLMSG_DONE:
+                return replies
+
+            if reply_type == NLMSG_ERROR:
+                error, = unpack_from("=i", reply_payload)
+                if error:
+                    raise OSError(-error, f"Netlink request failed with error {-error}.")
+
+                return replies
+
+            replies.append(reply_payload)
+
+            if not reply_flags & NLM_F_MULTI:
+                return replies
+
+
+def pack_genl(command: int, attributes: bytes, version: int = 1) -> bytes:
+    """pack a generic netlink payload"""
+
+    return pack(GENLMSGHDR_FORMAT, command, version, 0) + attributes
+
+
+def resolve_family(netlink_socket: socket, name: str) -> tuple[int, dict[str, int]]:
+    """resolve a generic netlink family
+    - return the family ID and its multicast groups"""
+
+    replies = request(
+        netlink_socket,
+        GENL_ID_CTRL,
+        0,
+        pack_genl(CTRL_CMD_GETFAMILY, pack_attribute(CTRL_ATTR_FAMILY_NAME, name.encode() + b'\0'))
+    )
+
+    attributes = parse_attributes(replies[0], GENLMSGHDR_LENGTH)
+    family_id, = unpack_from("=H", attributes[CTRL_ATTR_FAMILY_ID])
+
+    groups: dict[str, int] = dict()
+    for group in parse_attributes(attributes.get(CTRL_ATTR_MCAST_GROUPS, b'')).values():
+        group_attributes = parse_attributes(group)
+        group_id, = unpack_from("=I", group_attributes[CTRL_ATTR_MCAST_GRP_ID])
+        groups[group_attributes[CTRL_ATTR_MCAST_GRP_NAME].rstrip(b'\0').decode()] = group_id
+
+    logger.debug(f"Resolved netlink family {name}: {family_id} {groups}")
+    return family_id, groups
@@ -0,0 +1,227 @@
+"""
+rank nearby access points
+- reads the kernel's cached scan results over nl80211
+- classifies the access points as on/off the VIT network
+- ranks the VIT access points by signal, band and channel load
+- hands the best access point to the connection manager
+"""
+
+from collections import Counter
+from logging import getLogger
+from os import popen
+from platform import system as get_os_name
+from shlex import quote
+from socket import if_nametoindex
+from struct import pack, unpack_from
+
+import src.netlink
+from src.auth import classify_ssids
+
+# nl80211 commands and attributes
+NL80211_CMD_GET_SCAN = 32
+NL80211_ATTR_IFINDEX = 3
+NL80211_ATTR_BSS = 47
+NL80211_BSS_BSSID = 1
+NL80211_BSS_FREQUENCY = 2
+NL80211_BSS_INFORMATION_ELEMENTS = 6
+NL80211_BSS_SIGNAL_MBM = 7
+NL80211_BSS_STATUS = 9
+NL80211_BSS_STATUS_ASSOCIATED = 1
+
+# information element IDs
+IE_SSID = 0
+IE_BSS_LOAD = 11
+
+# signal bonus (in dB) for each band, since the higher bands are faster and less crowded
+BAND_BONUS = {
+    '2.4': 0,
+    '5': 10,
+    '6': 10
+}
+
+# signal penalty (in dB) for a fully loaded channel
+LOAD_PENALTY = 20
+
+# number of access points on a channel that counts as fully loaded,
+# used when the access point doesn't advertise its own load
+CO_CHANNEL_SATURATION = 10
+
+# create a logger for this module
+logger = getLogger(__name__)
+
+
+def get_band(frequency: int) -> str:
+    """get the band of a frequency (in MHz)"""
+
+    if frequency < 3000:
+        return '2.4'
+
+    elif frequency < 5925:
+        return '5'
+
+    return '6'
+
+
+def get_channel(frequency: int) -> int:
+    """get the channel number of a frequency (in MHz)"""
+
+    if frequency == 2484:
+        return 14
+
+    elif frequency < 3000:
+        return (frequency - 2407) // 5
+
+    elif frequency < 5925:
+        return (frequency - 5000) // 5
+
+    # 6 GHz channel 2 sits below channel 1, off the 5950 MHz grid
+    elif frequency == 5935:
+        return 2
+
+    return (frequency - 5950) // 5
+
+
+def parse_information_elements(data: bytes) -> dict[int, bytes]:
+    """parse the information elements advertised by an access point"""
+
+    elements: dict[int, bytes] = dict()
+    offset = 0
+
+    while offset + 2 <= len(data):
+        element_id, length = data[offset], data[offset + 1]
+        elements.setdefault(element_id, data[offset + 2:offset + 2 + length])
+        offset += 2 + length
+
+    return elements
+
+
+def parse_bss(interface: str, bss: bytes) -> dict[str, str | int | float | bool | None] | None:
+    """parse a single BSS from a scan result
+    - return None if the BSS is incomplete"""
+
+    attributes = src.netlink.parse_attributes(bss)
+    if NL80211_BSS_BSSID not in attributes or NL80211_BSS_FREQUENCY not in attributes:
+        return None
+
+    elements = parse_information_elements(attributes.get(NL80211_BSS_INFORMATION_ELEMENTS, b''))
+
+    frequency, = unpack_from("=I", attributes[NL80211_BSS_FREQUENCY])
+    signal = unpack_from("=i", attributes[NL80211_BSS_SIGNAL_MBM])[0] / 100 if NL80211_BSS_SIGNAL_MBM in attributes else None
+    status = unpack_from("=I", attributes[NL80211_BSS_STATUS])[0] if NL80211_BSS_STATUS in attributes else None
+
+    # the BSS load element holds the station count, then the channel utilization out of 255
+    bss_load = elements.get(IE_BSS_LOAD, b'')
+    load = bss_load[2] / 255 if len(bss_load) >= 3 else None
+
+    return {
+        'interface': interface,
+        'bssid': attributes[NL80211_BSS_BSSID].hex(':'),
+        'ssid': elements.get(IE_SSID, b'').decode(errors='replace'),
+        'frequency': frequency,
+        'band': get_band(frequency),
+        'channel': get_channel(frequency),
+        'signal': signal,
+        'load': load,
+        'associated': status == NL80211_BSS_STATUS_ASSOCIATED
+    }
+
+
+def get_scan_results(interface: str) -> list[dict[str, str | int | float | bool | None]]:
+    """read the kernel's cached scan results for an interface
+    - no new scan is triggered"""
+
+    os_name = get_os_name()
+    if os_name != 'Linux':
+        raise NotImplementedError(f"Unsupported OS: {os_name}")
+
+    with src.netlink.open_socket(src.netlink.NETLINK_GENERIC) as netlink_socket:
+        family_id, _ = src.netlink.resolve_family(netlink_socket, 'nl80211')
+
+        replies = src.netlink.request(
+            netlink_socket,
+            family_id,
+            src.netlink.NLM_F_DUMP,
+            src.netlink.pack_genl(
+                NL80211_CMD_GET_SCAN,
+                src.netlink.pack_attribute(NL80211_ATTR_IFINDEX, pack("=I", if_nametoindex(interface)))
+            )
+        )
+
+    results = []
+    for reply in replies:
+        bss = src.netlink.parse_attributes(reply, src.netlink.GENLMSGHDR_LENGTH).get(NL80211_ATTR_BSS)
+
+        if bss and (result := parse_bss(interface, bss)):
+            results.append(result)
+
+    logger.info(f"Read {len(results)} cached scan results for {interface}.")
+    return results
+
+
+def deduplicate_access_points(results: list[dict[str, str | int | float | bool | None]]) -> list[dict[str, str | int | float | bool | None]]:
+    """keep one result per access point seen by several interfaces
+    - prefer the interface associated with it, then the one with the strongest signal"""
+
+    def preference(result: dict[str, str | int | float | bool | None]) -> tuple[bool, bool, float]:
+        return bool(result['associated']), result['signal'] is not None, float(result['signal'] or 0)
+
+    best_results: dict[str, dict[str, str | int | float | bool | None]] = dict()
+
+    for result in results:
+        current = best_results.get(str(result['bssid']))
+
+        if current is None or preference(result) > preference(current):
+            best_results[str(result['bssid'])] = result
+
+    return list(best_results.values())
+
+
+def rank_access_points(results: list[dict[str, str | int | float | bool | None]]) -> list[dict[str, str | int | float | bool | None]]:
+    """classify and rank access points
+    - keep one result per access point, so the co-channel counts aren't inflated
+    - classify all the SSIDs in one batch
+    - estimate the channel load from co-channel access points where not advertised
+    - score each access point and sort, best first"""
+
+    results = deduplicate_access_points(results)
+
+    classifications = classify_ssids([str(result['ssid']) for result in results])
+    channel_counts = Counter((result['band'], result['channel']) for result in results)
+
+    for result in results:
+        result['vit'] = classifications[str(result['ssid'])]
+
+        if result['load'] is None:
+            others = channel_counts[(result['band'], result['channel'])] - 1
+            result['load'] = min(others / CO_CHANNEL_SATURATION, 1.0)
+
+        # access points without a signal reading sort last
+        if result['signal'] is None:
+            result['score'] = None
+        else:
+            result['score'] = round(
+                result['signal'] + BAND_BONUS[str(result['band'])] - LOAD_PENALTY * result['load'],  # type: ignore
+                2
+            )
+
+    return sorted(
+        results,
+        key=lambda result: (not result['vit'], result['score'] is None, -(result['score'] or 0))
+    )
+
+
+def connect_access_point(access_point: dict[str, str | int | float | bool | None]) -> bool:
+    """ask NetworkManager to connect to an access point
+    - return whether the connection succeeded"""
+
+    command = "nmcli device wifi connect {} bssid {} ifname {}".format(
+        quote(str(access_point['ssid'])),
+        quote(str(access_point['bssid'])),
+        quote(str(access_point['interface']))
+    )
+
+    output = popen(command)
+    logger.info(output.read().strip())
+
+    # `close` returns None if the command succeeded
+    return output.close() is None
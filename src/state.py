@@ -0,0 +1,148 @@
+"""
+manage runtime state
+- remembers the SSID and address of each interface, and whether it holds a session
+- records the outcome of background logouts
+- reads/writes the state file
+"""
+
+from contextlib import contextmanager
+from json import JSONDecodeError, dumps, load
+from logging import getLogger
+from os import getpid
+from pathlib import Path
+from threading import get_ident
+from time import time
+from typing import Iterator
+
+# file locks are only available on Unix
+try:
+    from fcntl import LOCK_EX, LOCK_UN, flock
+
+except ImportError:
+    flock = None  # type: ignore
+
+# create a logger for this module
+logger = getLogger(__name__)
+
+
+@contextmanager
+def locked(file_path: Path) -> Iterator[None]:
+    """hold an exclusive lock on a file
+    - the file itself is replaced on every write, so a separate lock file is locked
+    - without file locks (off Unix), don't lock"""
+
+    if flock is None:
+        yield
+        return
+
+    with open(file_path.with_suffix('.lock'), 'a') as lock_file:
+        flock(lock_file, LOCK_EX)
+
+        try:
+            yield
+
+        finally:
+            flock(lock_file, LOCK_UN)
+
+
+def write_atomically(file_path: Path, text: str) -> None:
+    """write a file so readers only ever see the old or the new contents
+    - the temporary file is unique to the process and thread, so concurrent writers don't clobber it"""
+
+    temporary_file_path = file_path.with_name(f".{file_path.name}.{getpid()}.{get_ident()}.tmp")
+    temporary_file_path.write_text(text)
+    temporary_file_path.replace(file_path)
+
+
+def load_state(state_file_path: Path) -> dict:
+    """load the state from file
+    - return an empty state if the file doesn't exist or is unreadable"""
+
+    if not state_file_path.exists():
+        return dict()
+
+    with open(state_file_path, 'r') as state_file:
+        try:
+            return load(state_file)
+
+        except JSONDecodeError:
+            logger.warning("State file is corrupt. Ignoring.")
+            return dict()
+
+
+@contextmanager
+def editing_state(state_file_path: Path) -> Iterator[dict]:
+    """load the state for editing and write it back
+    - hold the lock from the read to the write, so overlapping runs don't lose updates
+    - skip the write if nothing changed"""
+
+    with locked(state_file_path):
+        state = load_state(state_file_path)
+        original_state = dumps(state, sort_keys=True)
+
+        yield state
+
+        if dumps(state, sort_keys=True) != original_state:
+            write_atomically(state_file_path, dumps(state, indent=4))
+
+
+def update_state(state_file_path: Path, **values: str | float) -> None:
+    """update the state file
+    - merge the given values into the existing state"""
+
+    with editing_state(state_file_path) as state:
+        state.update({key.replace('_', '-'): value for key, value in values.items()})
+
+
+def save_interfaces(state_file_path: Path, interfaces: list[dict[str, str | bool | None]]) -> None:
+    """remember the SSID and address of each interface
+    - interfaces that aren't listed keep what was last saved for them"""
+
+    with editing_state(state_file_path) as state:
+        saved_interfaces = state.setdefault('interfaces', dict())
+
+        for interface in interfaces:
+            saved_interfaces[str(interface['interface'])] = {
+                'ssid': interface['ssid'],
+                'address': interface['address']
+            }
+
+    logger.info("Saved interface states.")
+
+
+def save_sessions(state_file_path: Path, sessions: dict[str, bool]) -> None:
+    """remember which interfaces hold a session after logging in"""
+
+    with editing_state(state_file_path) as state:
+        saved_interfaces = state.setdefault('interfaces', dict())
+
+        for name, session in sessions.items():
+            saved_interfaces.setdefault(name, {'ssid': 'not-connected', 'address': None})['session'] = session
+
+    logger.info("Saved interface sessions.")
+
+
+def forget_interfaces(state_file_path: Path, names: list[str] | None = None) -> None:
+    """mark interfaces as not connected
+    - forget every interface if no names are given"""
+
+    with editing_state(state_file_path) as state:
+        saved_interfaces = state.setdefault('interfaces', dict())
+
+        for name in (saved_interfaces if names is None else names):
+            saved_interfaces[name] = {'ssid': 'not-connected', 'address': None}
+
+    logger.info("Cleared interface states.")
+
+
+def get_interfaces(state_file_path: Path) -> dict[str, dict[str, str | bool | None]]:
+    """get the last known SSID and address of each interface, and whether it holds a session"""
+
+    return dict(load_state(state_file_path).get('interfaces', dict()))
+
+
+def record_logout(state_file_path: Path, status: str) -> None:
+    """record the outcome of a logout for later inspection"""
+
+    update_state(state_file_path, last_logout_status=status, last_logout_time=time())
+    logger.info(f"Recorded logout status: {status}")
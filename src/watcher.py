@@ -0,0 +1,423 @@
+"""
+watch wireless links for changes
+- listens to rtnetlink link/address events and nl80211 association events
+- debounces flapping links into login/logout actions
+- records raw netlink events and replays recordings without hardware
+"""
+
+from errno import ENOBUFS
+from json import dumps, loads
+from logging import getLogger
+from pathlib import Path
+from platform import system as get_os_name
+from queue import Queue
+from selectors import EVENT_READ, DefaultSelector
+from socket import AF_INET, if_indextoname, if_nameindex, inet_ntoa
+from struct import calcsize, unpack_from
+from threading import Thread
+from time import monotonic
+from typing import Callable, TextIO
+
+import src.interfaces
+import src.netlink
+
+# rtnetlink multicast groups
+RTNLGRP_LINK = 1
+RTNLGRP_IPV4_IFADDR = 5
+
+# rtnetlink message types
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+
+# rtnetlink struct layouts and attributes
+IFINFOMSG_FORMAT = "=BxHiII"
+IFADDRMSG_FORMAT = "=BBBBI"
+IFINFOMSG_LENGTH = calcsize(IFINFOMSG_FORMAT)
+IFADDRMSG_LENGTH = calcsize(IFADDRMSG_FORMAT)
+IFLA_IFNAME = 3
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+IFF_LOWER_UP = 0x10000
+
+# nl80211 commands, attributes and the multicast group they are sent to
+NL80211_MULTICAST_GROUP = 'mlme'
+NL80211_CMD_DEAUTHENTICATE = 39
+NL80211_CMD_DISASSOCIATE = 40
+NL80211_CMD_CONNECT = 46
+NL80211_CMD_DISCONNECT = 48
+NL80211_ATTR_IFINDEX = 3
+NL80211_ATTR_STATUS_CODE = 72
+
+# how long (in milliseconds) a link must stay in a state before acting on it
+DEFAULT_DEBOUNCE = 100
+
+# create a logger for this module
+logger = getLogger(__name__)
+
+
+def parse_route_message(message_type: int, payload: bytes) -> dict[str, str] | None:
+    """turn an rtnetlink message into a link event
+    - return None for messages that don't matter"""
+
+    if message_type in (RTM_NEWLINK, RTM_DELLINK) and len(payload) >= IFINFOMSG_LENGTH:
+        _, _, _, flags, _ = unpack_from(IFINFOMSG_FORMAT, payload)
+        name = src.netlink.parse_attributes(payload, IFINFOMSG_LENGTH).get(IFLA_IFNAME)
+
+        # link up on its own doesn't matter, only the address that follows does
+        if name and (message_type == RTM_DELLINK or not flags & IFF_LOWER_UP):
+            return {'kind': 'link-down', 'interface': name.rstrip(b'\0').decode()}
+
+    elif message_type in (RTM_NEWADDR, RTM_DELADDR) and len(payload) >= IFADDRMSG_LENGTH:
+        family, _, _, _, _ = unpack_from(IFADDRMSG_FORMAT, payload)
+        attributes = src.netlink.parse_attributes(payload, IFADDRMSG_LENGTH)
+
+        # IPv4 addresses carry the interface name as their label, e.g. `wlan0` or `wlan0:1`
+        if family == AF_INET and IFA_LABEL in attributes:
+            address = attributes.get(IFA_LOCAL, attributes.get(IFA_ADDRESS, b''))
+
+            return {
+                'kind': 'address-up' if message_type == RTM_NEWADDR else 'address-down',
+                'interface': attributes[IFA_LABEL].rstrip(b'\0').decode().split(':')[0],
+                'address': inet_ntoa(address) if len(address) == 4 else ''
+            }
+
+    return None
+
+
+def parse_nl80211_message(payload: bytes, get_interface_name: Callable[[int], str]) -> dict[str, str] | None:
+    """turn an nl80211 message into a link event
+    - name the interface from its index, since mlme events don't carry the name
+    - return None for messages that don't matter"""
+
+    if len(payload) < src.netlink.GENLMSGHDR_LENGTH:
+        return None
+
+    command = payload[0]
+    attributes = src.netlink.parse_attributes(payload, src.netlink.GENLMSGHDR_LENGTH)
+    if NL80211_ATTR_IFINDEX not in attributes:
+        return None
+
+    index, = unpack_from("=I", attributes[NL80211_ATTR_IFINDEX])
+
+    # the interface may be gone by the time the event is read
+    try:
+        interface = get_interface_name(index)
+
+    except (OSError, KeyError):
+        logger.debug(f"Unknown interface index {index}.")
+        return None
+
+    if command == NL80211_CMD_CONNECT:
+        # a failed connection attempt also reports a (non-zero) status code
+        status_code = unpack_from("=H", attributes[NL80211_ATTR_STATUS_CODE])[0] if NL80211_ATTR_STATUS_CODE in attributes else 0
+        if status_code == 0:
+            return {'kind': 'associated', 'interface': interface}
+
+    elif command in (NL80211_CMD_DISCONNECT, NL80211_CMD_DEAUTHENTICATE, NL80211_CMD_DISASSOCIATE):
+        return {'kind': 'disassociated', 'interface': interface}
+
+    return None
+
+
+def parse_datagram(source: str, data: bytes, get_interface_name: Callable[[int], str] = if_indextoname) -> list[dict[str, str]]:
+    """turn a netlink datagram from either source into link events"""
+
+    events = []
+
+    for message_type, _, payload in src.netlink.parse_messages(data):
+        if source == 'route':
+            event = parse_route_message(message_type, payload)
+        else:
+            event = parse_nl80211_message(payload, get_interface_name)
+
+        if event:
+            events.append(event)
+
+    return events
+
+
+class LinkWatcher:
+    """debounce link events into login/logout actions
+    - an interface must hold a state for the debounce window before it is acted on
+    - flapping back to the state last acted on cancels the pending action
+    - an action is only taken once per state change
+    - a logout is only taken for an interface that a login was confirmed on, from the address that login used"""
+
+    def __init__(self, debounce: float, is_wireless: Callable[[str], bool]) -> None:
+        self.debounce = debounce
+        self.is_wireless = is_wireless
+
+        # remember whether each interface seen is wireless, since removed ones can't be checked
+        self.tracked: dict[str, bool] = dict()
+
+        self.addresses: dict[str, str] = dict()
+        self.desired: dict[str, str] = dict()
+        self.acted: dict[str, str] = dict()
+        self.deadlines: dict[str, float] = dict()
+
+        # the address each session was logged in from, set from the action worker
+        # (single dict operations are atomic, so this needs no lock)
+        self.sessions: dict[str, str] = dict()
+
+    def handle(self, event: dict[str, str], now: float) -> None:
+        """update the state of an interface from an event"""
+
+        interface = event['interface']
+        if interface not in self.tracked:
+            self.tracked[interface] = self.is_wireless(interface)
+
+        if not self.tracked[interface]:
+            return
+
+        logger.debug(f"Link event: {event}")
+
+        if event['kind'] == 'address-up':
+            self.addresses[interface] = event['address']
+            self.want(interface, 'up', now)
+
+        elif event['kind'] == 'address-down':
+            if self.addresses.get(interface) in (event['address'], None):
+                self.addresses.pop(interface, None)
+                self.want(interface, 'down', now)
+
+        elif event['kind'] == 'link-down':
+            self.addresses.pop(interface, None)
+            self.want(interface, 'down', now)
+
+        # the address may be kept across a brief disassociation, so re-associating brings it back up
+        elif event['kind'] == 'disassociated':
+            self.want(interface, 'down', now)
+
+        elif event['kind'] == 'associated' and interface in self.addresses:
+            self.want(interface, 'up', now)
+
+    def want(self, interface: str, state: str, now: float) -> None:
+        """schedule a state change, restarting the debounce window"""
+
+        self.desired[interface] = state
+
+        if self.acted.get(interface, 'down') == state:
+            self.deadlines.pop(interface, None)
+        else:
+            self.deadlines[interface] = now + self.debounce
+
+    def next_deadline(self) -> float | None:
+        """get the time the next pending action is due, if any"""
+
+        return min(self.deadlines.values(), default=None)
+
+    def poll(self, now: float) -> list[tuple[str, str, str]]:
+        """take the actions that are due
+        - return (action, interface, address) for each
+        - skip the logout for an interface without a session, so it can't log out a session on another interface"""
+
+        actions = []
+
+        for interface, deadline in sorted(self.deadlines.items(), key=lambda item: item[1]):
+            if deadline > now:
+                continue
+
+            del self.deadlines[interface]
+            self.acted[interface] = self.desired[interface]
+
+            if self.desired[interface] == 'up':
+                actions.append(('login', interface, self.addresses[interface]))
+
+            elif (address := self.sessions.pop(interface, None)) is not None:
+                actions.append(('logout', interface, address))
+
+            else:
+                logger.debug(f"No session on {interface}. Not logging out.")
+
+        return actions
+
+    def confirm_login(self, interface: str, address: str) -> None:
+        """remember that a login on an interface holds a session
+        - ignore it if the interface went down while logging in"""
+
+        if self.acted.get(interface) == 'up' and self.addresses.get(interface) == address:
+            self.sessions[interface] = address
+
+
+def is_wireless_interface(interface: str) -> bool:
+    """check whether an interface is wireless"""
+
+    return interface in src.interfaces.get_wireless_interfaces()
+
+
+def take_snapshot(known_interfaces: list[str]) -> dict[str, str | None]:
+    """get the current address of every wireless interface
+    - include interfaces known from earlier events, which may have disappeared"""
+
+    interfaces = set(src.interfaces.get_wireless_interfaces()) | set(known_interfaces)
+    return {interface: src.interfaces.get_interface_address(interface) for interface in sorted(interfaces)}
+
+
+def snapshot_events(snapshot: dict[str, str | None]) -> list[dict[str, str]]:
+    """turn a snapshot of the interfaces into link events"""
+
+    return [
+        {'kind': 'address-up', 'interface': interface, 'address': address}
+        if address else
+        {'kind': 'link-down', 'interface': interface}
+        for interface, address in snapshot.items()
+    ]
+
+
+def watch(on_action: Callable[[str, str, str], bool], debounce: float, recording_path: Path | None = None) -> None:
+    """watch the wireless links until interrupted
+    - subscribe to rtnetlink and (where available) nl80211 events
+    - act on interfaces that already have an address
+    - hand each debounced action to `on_action` on a worker thread, so slow actions don't delay reading events
+    - `on_action` returns whether a login left the interface with a session, so only those are logged out
+    - resynchronise from a snapshot if the kernel drops events
+    - optionally record the raw events for replaying later"""
+
+    os_name = get_os_name()
+    if os_name != 'Linux':
+        raise NotImplementedError(f"Unsupported OS: {os_name}")
+
+    selector = DefaultSelector()
+
+    route_socket = src.netlink.open_socket(src.netlink.NETLINK_ROUTE, (RTNLGRP_LINK, RTNLGRP_IPV4_IFADDR))
+    selector.register(route_socket, EVENT_READ, 'route')
+
+    nl80211_socket = src.netlink.open_socket(src.netlink.NETLINK_GENERIC)
+
+    try:
+        _, groups = src.netlink.resolve_family(nl80211_socket, 'nl80211')
+        nl80211_socket.setsockopt(src.netlink.SOL_NETLINK, src.netlink.NETLINK_ADD_MEMBERSHIP, groups[NL80211_MULTICAST_GROUP])
+
+    except (OSError, KeyError) as e:
+        logger.warning(f"nl80211 events unavailable, watching rtnetlink only: {e!r}")
+        nl80211_socket.close()
+
+    else:
+        selector.register(nl80211_socket, EVENT_READ, 'nl80211')
+
+    link_watcher = LinkWatcher(debounce, is_wireless_interface)
+    recording_file: TextIO | None = open(recording_path, 'a') if recording_path else None
+
+    def record(entry: dict) -> None:
+        if recording_file:
+            recording_file.write(dumps({'time': monotonic(), **entry}) + "\n")
+            recording_file.flush()
+
+    def synchronise() -> None:
+        snapshot = take_snapshot(list(link_watcher.addresses))
+        record({'source': 'snapshot', 'interfaces': snapshot})
+
+        for event in snapshot_events(snapshot):
+            link_watcher.handle(event, monotonic())
+
+    actions: Queue[tuple[str, str, str] | None] = Queue()
+
+    def take_actions() -> None:
+        while (item := actions.get()) is not None:
+            action, interface, address = item
+
+            try:
+                if on_action(action, interface, address) and action == 'login':
+                    link_watcher.confirm_login(interface, address)
+
+            except Exception as e:
+                logger.exception(e)
+
+    # a daemon thread doesn't hold up exiting while an action is still running
+    Thread(target=take_actions, name="wicon-watch-actions", daemon=True).start()
+
+    # interfaces that are already up won't send an event
+    synchronise()
+
+    logger.info("Watching wireless links.")
+
+    try:
+        while True:
+            deadline = link_watcher.next_deadline()
+            timeout = None if deadline is None else max(deadline - monotonic(), 0)
+
+            for key, _ in selector.select(timeout):
+                try:
+                    data = key.fileobj.recv(src.netlink.RECEIVE_BUFFER_SIZE)  # type: ignore
+
+                except OSError as e:
+                    if e.errno != ENOBUFS:
+                        raise
+
+                    # the kernel dropped events, so the current state has to be read afresh
+                    logger.warning("Netlink events were dropped. Resynchronising.")
+                    synchronise()
+                    continue
+
+                if key.data == 'route':
+                    record({'source': key.data, 'data': data.hex()})
+                else:
+                    # nl80211 events only name the interface by index, so keep the names for replaying
+                    record({'source': key.data, 'data': data.hex(), 'interfaces': {str(index): name for index, name in if_nameindex()}})
+
+                for event in parse_datagram(key.data, data):
+                    link_watcher.handle(event, monotonic())
+
+            for action, interface, address in link_watcher.poll(monotonic()):
+                logger.info(f"Link watcher triggered {action} on {interface} ({address}).")
+                actions.put((action, interface, address))
+
+    finally:
+        actions.put(None)
+
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()  # type: ignore
+
+        selector.close()
+
+        if recording_file:
+            recording_file.close()
+
+
+def replay(recording_path: Path, debounce: float, has_session: Callable[[str], bool] = lambda interface: True) -> list[dict[str, str | float]]:
+    """replay recorded netlink events on a virtual clock
+    - every interface in the recording is treated as wireless
+    - snapshots (taken at startup and after dropped events) are replayed as the events they stand for
+    - logins on the interfaces `has_session` accepts (by default, all of them) are taken to leave a session
+    - return the actions that would have been taken, with their time from the first event"""
+
+    link_watcher = LinkWatcher(debounce, lambda interface: True)
+    actions: list[dict[str, str | float]] = []
+    start_time: float | None = None
+
+    def take_due_actions(now: float) -> None:
+        for action, interface, address in link_watcher.poll(now):
+            actions.append({'time': round(now - start_time, 6), 'action': action, 'interface': interface, 'address': address})  # type: ignore
+
+            if action == 'login' and has_session(interface):
+                link_watcher.confirm_login(interface, address)
+
+    with open(recording_path, 'r') as recording_file:
+        for line in recording_file:
+            if not line.strip():
+                continue
+
+            record = loads(line)
+            if start_time is None:
+                start_time = record['time']
+
+            # actions due before this event happen first, as they would have live
+            while (deadline := link_watcher.next_deadline()) is not None and deadline <= record['time']:
+                take_due_actions(deadline)
+
+            if record['source'] == 'snapshot':
+                events = snapshot_events(record['interfaces'])
+            else:
+                interfaces = record.get('interfaces', dict())
+                events = parse_datagram(record['source'], bytes.fromhex(record['data']), lambda index: interfaces[str(index)])
+
+            for event in events:
+                link_watcher.handle(event, record['time'])
+
+    while (deadline := link_watcher.next_deadline()) is not None:
+        take_due_actions(deadline)
+
+    return actions
@@ -0,0 +1,163 @@
+"""
+check how scan results are parsed and ranked
+- checks the channel numbers of each band
+- checks that BSS attributes are read the way the kernel sends them
+- checks the deduplication and ranking of access points
+"""
+
+from struct import pack
+
+import pytest
+
+import src.netlink
+import src.scan
+
+
+def access_point(bssid: str, ssid: str = "VIT2.4G", frequency: int = 2412, signal: float | None = -50.0, load: float | None = None, associated: bool = False, interface: str = 'wlan0') -> dict:
+    """build a parsed access point"""
+
+    return {
+        'interface': interface,
+        'bssid': bssid,
+        'ssid': ssid,
+        'frequency': frequency,
+        'band': src.scan.get_band(frequency),
+        'channel': src.scan.get_channel(frequency),
+        'signal': signal,
+        'load': load,
+        'associated': associated
+    }
+
+
+def bss(bssid: bytes | None = b'\xaa\xbb\xcc\x00\x00\x01', frequency: int | None = 2412, signal: int | None = None, status: int | None = None, elements: bytes = b'') -> bytes:
+    """pack a BSS the way nl80211 sends it, leaving out the attributes that are None"""
+
+    attributes = b''
+    if bssid is not None:
+        attributes += src.netlink.pack_attribute(src.scan.NL80211_BSS_BSSID, bssid)
+    if frequency is not None:
+        attributes += src.netlink.pack_attribute(src.scan.NL80211_BSS_FREQUENCY, pack("=I", frequency))
+    if elements:
+        attributes += src.netlink.pack_attribute(src.scan.NL80211_BSS_INFORMATION_ELEMENTS, elements)
+    if signal is not None:
+        attributes += src.netlink.pack_attribute(src.scan.NL80211_BSS_SIGNAL_MBM, pack("=i", signal))
+    if status is not None:
+        attributes += src.netlink.pack_attribute(src.scan.NL80211_BSS_STATUS, pack("=I", status))
+
+    return attributes
+
+
+@pytest.mark.parametrize(('frequency', 'band', 'channel'), [
+    (2412, '2.4', 1),
+    (2472, '2.4', 13),
+    (2484, '2.4', 14),
+    (5180, '5', 36),
+    (5825, '5', 165),
+    # 6 GHz channel 2 sits below channel 1, off the 5950 MHz grid
+    (5935, '6', 2),
+    (5955, '6', 1),
+    (7115, '6', 233)
+])
+def test_channel(frequency, band, channel):
+    assert src.scan.get_band(frequency) == band
+    assert src.scan.get_channel(frequency) == channel
+
+
+@pytest.mark.parametrize(('packed_bss', 'expected'), [
+    (
+        bss(signal=-5000, status=src.scan.NL80211_BSS_STATUS_ASSOCIATED, elements=bytes([0, 7]) + b"VIT2.4G"),
+        {'bssid': 'aa:bb:cc:00:00:01', 'ssid': "VIT2.4G", 'channel': 1, 'signal': -50.0, 'load': None, 'associated': True}
+    ),
+    (
+        # the BSS load element holds the station count, then the channel utilization out of 255
+        bss(frequency=5180, signal=-7250, elements=bytes([0, 4]) + b"home" + bytes([11, 5, 3, 0, 51, 0, 0])),
+        {'bssid': 'aa:bb:cc:00:00:01', 'ssid': "home", 'channel': 36, 'signal': -72.5, 'load': 0.2, 'associated': False}
+    ),
+    (
+        # hidden networks have no SSID, and not every driver reports a signal
+        bss(frequency=5935),
+        {'bssid': 'aa:bb:cc:00:00:01', 'ssid': "", 'channel': 2, 'signal': None, 'load': None, 'associated': False}
+    ),
+    (bss(bssid=None), None),
+    (bss(frequency=None), None)
+])
+def test_parse_bss(packed_bss, expected):
+    result = src.scan.parse_bss('wlan0', packed_bss)
+
+    if expected is None:
+        assert result is None
+    else:
+        assert {key: result[key] for key in expected} == expected
+        assert result['interface'] == 'wlan0'
+
+
+@pytest.mark.parametrize(('results', 'expected'), [
+    # the same access point seen by two interfaces: the associated one wins, even with a weaker signal
+    (
+        [access_point('01', signal=-40.0, interface='wlan1'), access_point('01', signal=-60.0, associated=True)],
+        [('01', 'wlan0')]
+    ),
+    # neither associated: the strongest signal wins
+    (
+        [access_point('01', signal=-70.0), access_point('01', signal=-45.0, interface='wlan1')],
+        [('01', 'wlan1')]
+    ),
+    # a signal reading beats none
+    (
+        [access_point('01', signal=None), access_point('01', signal=-90.0, interface='wlan1')],
+        [('01', 'wlan1')]
+    ),
+    # different access points are all kept
+    (
+        [access_point('01'), access_point('02')],
+        [('01', 'wlan0'), ('02', 'wlan0')]
+    )
+])
+def test_deduplicate_access_points(results, expected):
+    assert [(result['bssid'], result['interface']) for result in src.scan.deduplicate_access_points(results)] == expected
+
+
+@pytest.mark.parametrize(('results', 'expected'), [
+    # VIT access points come first, however strong the others are
+    (
+        [access_point('01', ssid="home", signal=-30.0), access_point('02', signal=-80.0)],
+        ['02', '01']
+    ),
+    # the 5 GHz bonus outweighs a slightly weaker signal
+    (
+        [access_point('01', signal=-50.0), access_point('02', ssid="VIT5G", frequency=5180, signal=-55.0)],
+        ['02', '01']
+    ),
+    # an advertised full load costs more than a weaker signal
+    (
+        [access_point('01', signal=-50.0, load=1.0), access_point('02', frequency=2437, signal=-60.0, load=0.0)],
+        ['02', '01']
+    ),
+    # access points without a signal reading sort last
+    (
+        [access_point('01', signal=None), access_point('02', frequency=2437, signal=-85.0)],
+        ['02', '01']
+    ),
+    # an access point seen twice only counts once towards the co-channel load
+    (
+        [access_point('01', signal=-50.0), access_point('01', signal=-52.0, interface='wlan1'), access_point('02', frequency=2437, signal=-51.0)],
+        ['01', '02']
+    )
+])
+def test_rank_access_points(results, expected):
+    assert [result['bssid'] for result in src.scan.rank_access_points(results)] == expected
+
+
+def test_rank_access_points_scores():
+    ranked = src.scan.rank_access_points([
+        access_point('01', signal=-50.0),
+        access_point('02', signal=-60.0),
+        access_point('03', ssid="VIT5G", frequency=5180, signal=-65.0, load=0.5)
+    ])
+
+    # two access points share channel 1, so each sees one co-channel neighbour
+    assert [(result['bssid'], result['vit'], result['score']) for result in ranked] == [
+        ('01', True, -52.0),
+        ('02', True, -62.0),
+        ('03', True, -65.0)
+    ]
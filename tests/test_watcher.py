@@ -0,0 +1,93 @@
+"""
+replay recorded netlink event sequences through the link watcher
+- checks the debounced actions and their timings
+- checks that only interfaces holding a session are logged out
+- checks that nl80211 events are read the way the kernel sends them
+"""
+
+from pathlib import Path
+from struct import pack
+from typing import Callable
+
+import pytest
+
+import src.netlink
+import src.watcher
+
+RECORDINGS_PATH = Path(__file__).parent / "recordings"
+
+# debounce window (in seconds) used for all replays
+DEBOUNCE = 0.1
+
+
+def replay(name: str, has_session: Callable[[str], bool] = lambda interface: True) -> list[tuple[float, str, str]]:
+    """replay a recording and return (time, action, interface) for each action"""
+
+    return [
+        (action['time'], action['action'], action['interface'])
+        for action in src.watcher.replay(RECORDINGS_PATH / f"{name}.jsonl", DEBOUNCE, has_session)
+    ]
+
+
+def test_address_at_startup_logs_in():
+    assert replay('startup-address') == [(pytest.approx(0.1), 'login', 'wlan0')]
+
+
+def test_address_flap_is_cancelled():
+    assert replay('address-flap') == [(pytest.approx(0.1), 'login', 'wlan0')]
+
+
+def test_reassociation_is_cancelled():
+    assert replay('reassociation') == [(pytest.approx(0.1), 'login', 'wlan0')]
+
+
+def test_sustained_down_logs_out():
+    assert replay('sustained-down') == [
+        (pytest.approx(0.7), 'login', 'wlan0'),
+        # the debounce window restarts with each teardown event
+        (pytest.approx(2.13), 'logout', 'wlan0')
+    ]
+
+
+def test_other_interface_going_down_keeps_the_session():
+    # only wlan0 is on a VIT network, so the login on wlan1 leaves no session to log out
+    assert replay('two-interfaces', {'wlan0'}.__contains__) == [
+        (pytest.approx(0.1), 'login', 'wlan0'),
+        (pytest.approx(0.1), 'login', 'wlan1')
+    ]
+
+
+def test_logout_uses_the_login_address():
+    # the address is gone by the time the logout fires, so it comes from the login
+    actions = src.watcher.replay(RECORDINGS_PATH / "two-interfaces.jsonl", DEBOUNCE)
+
+    assert [(action['action'], action['interface'], action['address']) for action in actions] == [
+        ('login', 'wlan0', '10.10.0.5'),
+        ('login', 'wlan1', '192.168.1.20'),
+        ('logout', 'wlan1', '192.168.1.20')
+    ]
+
+
+def test_login_confirmed_after_going_down_is_ignored():
+    link_watcher = src.watcher.LinkWatcher(DEBOUNCE, lambda interface: True)
+
+    link_watcher.handle({'kind': 'address-up', 'interface': 'wlan0', 'address': '10.10.0.5'}, 0.0)
+    assert link_watcher.poll(0.1) == [('login', 'wlan0', '10.10.0.5')]
+
+    # the link goes down while the login is still running
+    link_watcher.handle({'kind': 'link-down', 'interface': 'wlan0'}, 0.2)
+    assert link_watcher.poll(0.3) == []
+
+    link_watcher.confirm_login('wlan0', '10.10.0.5')
+    assert link_watcher.sessions == {}
+
+
+def test_nl80211_event_is_named_from_its_index():
+    # mlme events only carry the wiphy and interface indexes
+    payload = src.netlink.pack_genl(
+        src.watcher.NL80211_CMD_DISCONNECT,
+        src.netlink.pack_attribute(1, pack("=I", 0)) + src.netlink.pack_attribute(src.watcher.NL80211_ATTR_IFINDEX, pack("=I", 3))
+    )
+
+    assert src.watcher.parse_nl80211_message(payload, {3: 'wlan0'}.__getitem__) == {'kind': 'disassociated', 'interface': 'wlan0'}
+    assert src.watcher.parse_nl80211_message(payload, {}.__getitem__) is None